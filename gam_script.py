@@ -1,14 +1,49 @@
 import subprocess
+import atexit
 import json
 from datetime import datetime, timezone
 import csv
+import io
 import os
+import re
+import shlex
 from pathlib import Path
 import logging
+import uuid
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pv
+except ImportError:
+    pa = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 EXTERNAL_USERS_FILE = "external_users.txt"
 OUTPUT_DIR = "output"
 LOG_FILE = f"{OUTPUT_DIR}/scan_log.txt"
+RUNLOG_FILE = f"{OUTPUT_DIR}/runlog.jsonl"
+RUNLOG_BUFFER = 1 << 16
+SCRIPT_NAME = "gsuite-drive-external-shares"
+ARROW_BLOCK_SIZE = 8 << 20
+GAM_PIPE_BUFFER = 1 << 20
+PERM_EMAIL_RE = re.compile(r"^permissions\.\d+\.emailAddress$")
+OWNER_COLUMN = "owners.0.emailAddress"
+
+log = logging.getLogger(__name__)
+
+_runlog = None
+# Per-user fallback scans write runlog entries from worker threads
+_runlog_lock = threading.Lock()
 
 def setup_logging():
     Path(OUTPUT_DIR).mkdir(exist_ok=True)
@@ -26,69 +61,334 @@ def setup_logging():
 
 def run_gam_command(args):
     """Run a GAM command and return output as text"""
-    logging.info(f"Running GAM: gam {' '.join(args)}")
+    return _run_gam(args).stdout
+
+def _run_gam(args):
+    log.info("Running GAM: gam %s", " ".join(args))
     try:
         result = subprocess.run(["gam"] + args, capture_output=True, text=True)
     except FileNotFoundError as e:
         raise RuntimeError("'gam' command not found. Please install GAM and ensure it is on your PATH.") from e
 
     if result.returncode != 0:
-        err = result.stderr.strip()
-        logging.error(f"Command failed: {err}")
-        if (
-            "No Client Access allowed" in err
-            or "oauth2service_json" in err
-            or "oauth2.txt" in err
-        ):
-            err += " - GAM appears to be unauthenticated. Run 'gam oauth create' or configure your service account."
-        raise RuntimeError(f"Command failed: {err}")
-    return result.stdout
+        raise _gam_error(result.stderr.strip())
+    return result
+
+def _gam_error(err):
+    log.error("Command failed: %s", err)
+    if (
+        "No Client Access allowed" in err
+        or "oauth2service_json" in err
+        or "oauth2.txt" in err
+    ):
+        err += " - GAM appears to be unauthenticated. Run 'gam oauth create' or configure your service account."
+    return RuntimeError(f"Command failed: {err}")
+
+@contextmanager
+def stream_gam_csv(args, num_threads=None):
+    """Run a GAM command with its CSV output redirected to stdout and yield the pipe
 
-def get_drive_files_for_user(user):
-    """Export all Drive file ACLs for a user"""
-    output_file = f"{OUTPUT_DIR}/{user}_files.csv"
-    run_gam_command(["user", user, "drive", "list", "fields", "id,title,permissions", "to", "csv", output_file])
-    return output_file
+    With num_threads, GAM runs the command over that many processes and merges their CSV output.
+    """
+    if num_threads:
+        args = ["config", "num_threads", str(num_threads), "redirect", "csv", "-", "multiprocess"] + args
+    else:
+        args = ["redirect", "csv", "-"] + args
+    log.info("Running GAM: gam %s", " ".join(args))
+    with tempfile.TemporaryFile() as stderr:
+        try:
+            proc = subprocess.Popen(["gam"] + args, stdout=subprocess.PIPE, stderr=stderr, bufsize=GAM_PIPE_BUFFER)
+        except FileNotFoundError as e:
+            raise RuntimeError("'gam' command not found. Please install GAM and ensure it is on your PATH.") from e
+
+        with proc:
+            try:
+                yield proc.stdout
+            except BaseException:
+                proc.kill()
+                raise
+
+        if proc.returncode != 0:
+            stderr.seek(0)
+            raise _gam_error(stderr.read().decode("utf-8", "replace").strip())
 
-def get_shared_drive_files():
-    """Export all shared drive files and their ACLs"""
-    output_file = f"{OUTPUT_DIR}/shared_drives_files.csv"
-    run_gam_command(["all", "drives", "show", "filelist", "fields", "id,title,permissions", "to", "csv", output_file])
-    return output_file
+def stream_user_acls(user):
+    """Stream all Drive file ACLs for a user as CSV, without writing them to disk"""
+    return stream_gam_csv(["user", user, "drive", "list", "fields", "id,title,permissions"])
 
-def is_external(email, domain):
-    return not email.endswith(f"@{domain}")
+def stream_all_users_acls(num_threads=None):
+    """Stream the Drive file ACLs of every user from a single GAM invocation"""
+    return stream_gam_csv(["all", "users", "drive", "list", "fields", "id,title,owners,permissions"],
+                          num_threads=num_threads)
+
+def stream_shared_drive_acls():
+    """Stream all shared drive files and their ACLs as CSV, without writing them to disk"""
+    return stream_gam_csv(["all", "drives", "show", "filelist", "fields", "id,title,permissions"])
+
+def run_gam_batch(commands, batch_threads=None):
+    """Write GAM commands to a batch file and run them in a single GAM process
+
+    GAM's exit status covers the batch as a whole, not each command in it, so the batch's output is logged
+    to keep individual failures auditable. The batch file is deleted afterwards.
+    """
+    batch_file = f"{OUTPUT_DIR}/batch_{uuid.uuid4().hex}.txt"
+    try:
+        with open(batch_file, "w", encoding="utf-8") as f:
+            f.writelines(commands)
+        args = ["batch", batch_file]
+        if batch_threads:
+            args = ["config", "num_threads", str(batch_threads)] + args
+        result = _run_gam(args)
+    finally:
+        try:
+            os.remove(batch_file)
+        except FileNotFoundError:
+            pass
+
+    output = result.stdout.splitlines()
+    for line in output:
+        log.info("GAM batch: %s", line)
+    for line in result.stderr.splitlines():
+        log.warning("GAM batch: %s", line)
+    log.info("GAM batch finished: %d commands, %d lines of output", len(commands), len(output))
+    return result.stdout
 
 def parse_external_users(filename):
     with open(filename, "r") as f:
-        return {line.strip().lower() for line in f if line.strip()}
-
-def process_csv(csv_file, domain, external_users=None, dry_run=True):
-    external_count = 0
-    removed_count = 0
+        return frozenset(line.strip().lower() for line in f if line.strip())
 
-    with open(csv_file, newline='', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
+def _iter_external_shares_csv(stream, domain):
+    """Yield (owner, file_id, title, email) for each external permission using the csv module"""
+    # The csv module only parses str, so this fallback has to decode; the pyarrow path reads the raw bytes
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    try:
+        reader = csv.reader(text)
+        header = next(reader, None)
+        if header is None:
+            return
+        id_idx = header.index("id") if "id" in header else None
+        title_idx = header.index("title") if "title" in header else None
+        owner_idx = header.index(OWNER_COLUMN) if OWNER_COLUMN in header else None
+        email_idxs = [i for i, h in enumerate(header) if PERM_EMAIL_RE.match(h)]
+        suffix = f"@{domain.lower()}"
         for row in reader:
-            file_id = row.get("id")
-            title = row.get("title")
-            for key in row:
-                if key.startswith("permissions.") and ".emailAddress" in key:
-                    email = row[key].lower()
-                    if is_external(email, domain):
-                        external_count += 1
-                        logging.info(f"External share found: '{title}' ({file_id}) shared with {email}")
-                        if external_users and email in external_users:
-                            if dry_run:
-                                logging.info(f"[DRY RUN] Would remove {email} from {file_id}")
-                            else:
-                                logging.info(f"Removing {email} from {file_id}")
-                                try:
-                                    run_gam_command(["user", "admin", "delete", "drivefileacl", file_id, email])
-                                    removed_count += 1
-                                except RuntimeError as e:
-                                    logging.error(f"Failed to remove {email}: {e}")
-    return external_count, removed_count
+            file_id = row[id_idx] if id_idx is not None else None
+            title = row[title_idx] if title_idx is not None else None
+            owner = row[owner_idx].lower() if owner_idx is not None else None
+            for i in email_idxs:
+                email = row[i]
+                if email.endswith(suffix):
+                    continue
+                # GAM normally emits lowercase addresses, so only lowercase on a miss
+                email = email.lower()
+                if not email.endswith(suffix):
+                    yield owner, file_id, title, email
+    finally:
+        text.detach()
+
+def _open_arrow_acls(stream):
+    """Open a pyarrow batch reader over the id, title, owner and permission email columns
+
+    Returns (reader, email_cols, meta_cols), or None if the CSV has no permission emails.
+    """
+    header = next(csv.reader([stream.readline().decode('utf-8')]), None)
+    if header is None:
+        return None
+    email_cols = [h for h in header if PERM_EMAIL_RE.match(h)]
+    meta_cols = [h for h in ("id", "title", OWNER_COLUMN) if h in header]
+    if not email_cols:
+        # Read GAM's output to the end, as the csv path does, so it does not fail writing to a closed pipe
+        while stream.read(GAM_PIPE_BUFFER):
+            pass
+        return None
+    columns = meta_cols + email_cols
+    reader = pv.open_csv(
+        stream,
+        read_options=pv.ReadOptions(column_names=header, block_size=ARROW_BLOCK_SIZE),
+        parse_options=pv.ParseOptions(newlines_in_values=True),
+        convert_options=pv.ConvertOptions(
+            include_columns=columns,
+            column_types={c: pa.string() for c in columns},
+            strings_can_be_null=False,
+        ),
+    )
+    return reader, email_cols, meta_cols
+
+def _external_mask(column, suffix):
+    """Return the lowercased emails in a pyarrow column and a mask of those outside the internal domain"""
+    emails = pc.utf8_lower(column)
+    return emails, pc.invert(pc.ends_with(emails, pattern=suffix))
+
+def _iter_external_shares_arrow(stream, domain):
+    """Yield (owner, file_id, title, email) for each external permission using pyarrow's CSV reader"""
+    opened = _open_arrow_acls(stream)
+    if opened is None:
+        return
+    reader, email_cols, meta_cols = opened
+    suffix = f"@{domain.lower()}"
+    for batch in reader:
+        ids = batch.column("id") if "id" in meta_cols else None
+        titles = batch.column("title") if "title" in meta_cols else None
+        owners = pc.utf8_lower(batch.column(OWNER_COLUMN)) if OWNER_COLUMN in meta_cols else None
+        for col in email_cols:
+            emails, mask = _external_mask(batch.column(col), suffix)
+            ext_emails = pc.filter(emails, mask).to_pylist()
+            if not ext_emails:
+                continue
+            ext_ids = pc.filter(ids, mask).to_pylist() if ids is not None else [None] * len(ext_emails)
+            ext_titles = pc.filter(titles, mask).to_pylist() if titles is not None else [None] * len(ext_emails)
+            ext_owners = pc.filter(owners, mask).to_pylist() if owners is not None else [None] * len(ext_emails)
+            yield from zip(ext_owners, ext_ids, ext_titles, ext_emails)
+
+def iter_external_shares(stream, domain):
+    """Yield (owner, file_id, title, email) for each permission outside the internal domain in a binary CSV stream
+
+    owner is None unless the export includes the owners field.
+    """
+    if pa is not None:
+        return _iter_external_shares_arrow(stream, domain)
+    return _iter_external_shares_csv(stream, domain)
+
+def iter_unique_external_shares(stream, domain):
+    """Like iter_external_shares, but yield each (file_id, email) pair once
+
+    A 'gam all users' export lists a file once for every user who can see it.
+    """
+    seen = set()
+    for owner, file_id, title, email in iter_external_shares(stream, domain):
+        key = (file_id, email)
+        if key in seen:
+            continue
+        seen.add(key)
+        yield owner, file_id, title, email
+
+def _count_external_shares_arrow(stream, domain):
+    """Count unique external (file_id, email) shares per owner with vectorised pyarrow kernels"""
+    opened = _open_arrow_acls(stream)
+    if opened is None:
+        return {}
+    reader, email_cols, meta_cols = opened
+    suffix = f"@{domain.lower()}"
+    parts = []
+    for batch in reader:
+        nulls = pa.nulls(batch.num_rows, pa.string())
+        ids = batch.column("id") if "id" in meta_cols else nulls
+        owners = pc.utf8_lower(batch.column(OWNER_COLUMN)) if OWNER_COLUMN in meta_cols else nulls
+        for col in email_cols:
+            emails, mask = _external_mask(batch.column(col), suffix)
+            parts.append(pa.table({
+                "id": pc.filter(ids, mask),
+                "email": pc.filter(emails, mask),
+                "owner": pc.filter(owners, mask),
+            }))
+    if not parts:
+        return {}
+    # Only external shares are kept, so the de-duplication runs over a small table
+    unique = pa.concat_tables(parts).group_by(["id", "email"]).aggregate([("owner", "min")])
+    per_owner = unique.group_by("owner_min").aggregate([("email", "count")])
+    return dict(zip(per_owner.column("owner_min").to_pylist(), per_owner.column("email_count").to_pylist()))
+
+def count_external_shares(stream, domain):
+    """Return {owner: count} of unique permissions outside the internal domain, without logging each share"""
+    if pa is not None:
+        return _count_external_shares_arrow(stream, domain)
+    counts = {}
+    for owner, _, _, _ in iter_unique_external_shares(stream, domain):
+        counts[owner] = counts.get(owner, 0) + 1
+    return counts
+
+def _claim_share(seen, key):
+    """Record key in a dict shared between threads; True only for the first caller"""
+    # dict.setdefault is atomic under the GIL, so exactly one caller gets its own marker back
+    marker = object()
+    return seen.setdefault(key, marker) is marker
+
+def process_csv(csv_file, domain, external_users=None, dry_run=True, batch_threads=None, count_only=False, seen=None):
+    """Scan an ACL CSV and remove shares to listed external users
+
+    csv_file is a path or a context manager yielding a binary CSV stream, such as stream_user_acls().
+    """
+    counts = process_csv_by_owner(csv_file, domain, external_users, dry_run=dry_run, batch_threads=batch_threads,
+                                  count_only=count_only, seen=seen)
+    return sum(c for c, _ in counts.values()), sum(q for _, q in counts.values())
+
+def process_csv_by_owner(csv_file, domain, external_users=None, dry_run=True, batch_threads=None, count_only=False,
+                         seen=None):
+    """Like process_csv, but return {owner: [checked, queued]} for exports that include file owners
+
+    queued counts removals submitted in a GAM batch that exited successfully; GAM does not report them per command.
+
+    With count_only, external shares are only counted: nothing is logged per share or removed.
+    Shares are only logged, and removals only submitted, once csv_file has closed cleanly, so a failed GAM
+    export logs and removes nothing. seen is a dict shared between scans whose exports overlap, such as the
+    per-user fallback; a (file_id, email) share already claimed by another scan is skipped.
+    """
+    if isinstance(csv_file, (str, os.PathLike)):
+        csv_file = open(csv_file, "rb")
+
+    if count_only and seen is None:
+        with csv_file as stream:
+            counts = {owner: [found, 0] for owner, found in count_external_shares(stream, domain).items()}
+        log.info("Found %d external shares", sum(found for found, _ in counts.values()))
+        return counts
+
+    with csv_file as stream:
+        found = list(iter_unique_external_shares(stream, domain))
+    if seen is not None:
+        found = [share for share in found if _claim_share(seen, (share[1], share[3]))]
+
+    counts = {}
+    pending = []
+
+    for owner, file_id, title, email in found:
+        owner_counts = counts.setdefault(owner, [0, 0])
+        owner_counts[0] += 1
+        if count_only:
+            continue
+        log.info("External share found: '%s' (%s) shared with %s", title, file_id, email)
+        if not external_users or email not in external_users:
+            continue
+        if dry_run:
+            log.info("[DRY RUN] Would remove %s from %s", email, file_id)
+        else:
+            log.info("Queueing removal of %s from %s", email, file_id)
+            command = ["gam", "user", "admin", "delete", "drivefileacl", file_id, email]
+            pending.append((owner, " ".join(shlex.quote(arg) for arg in command) + "\n"))
+
+    if count_only:
+        log.info("Found %d external shares", len(found))
+        return counts
+
+    if pending:
+        log.info("Submitting %d external share removals via GAM batch", len(pending))
+        try:
+            run_gam_batch([command for _, command in pending], batch_threads)
+            for owner, _ in pending:
+                counts[owner][1] += 1
+        except RuntimeError as e:
+            log.error("Failed to remove external shares: %s", e)
+    return counts
+
+def _scan_user(user, domain, external_users, dry_run, batch_threads=None, count_only=False, seen=None):
+    """Export, scan and log the Drive ACLs for a single user"""
+    log.info("\n--- Processing %s ---", user)
+    try:
+        checked, queued = process_csv(stream_user_acls(user), domain, external_users, dry_run=dry_run,
+                                      batch_threads=batch_threads, count_only=count_only, seen=seen)
+        write_run_log(SCRIPT_NAME, "success", user, domain, dry_run, checked, queued)
+    except Exception as e:
+        log.error("Error processing user %s: %s", user, e)
+        write_run_log(SCRIPT_NAME, "error", user, domain, dry_run, 0, 0)
+
+def _positive_int(value):
+    import argparse
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {number}")
+    return number
 
 def main():
     import argparse
@@ -99,69 +399,80 @@ def main():
     parser.add_argument("--external-users-file", default=EXTERNAL_USERS_FILE, help="File of external users to remove")
     parser.add_argument("--remove", action="store_true", help="Remove sharing from listed external users")
     parser.add_argument("--dry-run", action="store_true", help="Don't actually remove, just print actions")
+    parser.add_argument("--count-only", action="store_true", help="Only count external shares, without logging each one")
+    parser.add_argument("--concurrency", type=_positive_int, default=16, help="Number of users to scan in parallel in workspace mode")
+    parser.add_argument("--batch-threads", type=_positive_int, help="Number of GAM threads used to run batched removals")
     parser.add_argument("--auth-mode", choices=["personal", "service"], default="service", help="Choose auth mode: 'personal' for OAuth flow (opens browser), 'service' for Workspace service account (default)")
 
     args = parser.parse_args()
+    if args.count_only and args.remove:
+        parser.error("--count-only cannot be combined with --remove")
 
     setup_logging()
+    open_run_log()
 
     if '.' not in args.domain:
-        logging.error(f"Invalid domain '{args.domain}'. Please provide a valid domain name.")
+        log.error("Invalid domain '%s'. Please provide a valid domain name.", args.domain)
         return
     if args.auth_mode == "personal":
-        logging.info("Using personal OAuth mode. Running 'gam oauth create'...")
+        log.info("Using personal OAuth mode. Running 'gam oauth create'...")
         try:
             run_gam_command(["oauth", "create"])
-            logging.info("OAuth authorization completed.")
+            log.info("OAuth authorization completed.")
         except Exception as e:
-            logging.error(f"OAuth flow failed: {e}")
+            log.error("OAuth flow failed: %s", e)
             return
     else:
-        logging.info("Using service account mode (domain-wide delegation).")
+        log.info("Using service account mode (domain-wide delegation).")
 
-    logging.info("==== Drive Sharing Scan Started ====")
+    log.info("==== Drive Sharing Scan Started ====")
 
-    external_users = parse_external_users(args.external_users_file)
-    script_name = "gsuite-drive-external-shares"
+    external_users = None if args.count_only else parse_external_users(args.external_users_file)
     dry_run = args.dry_run or not args.remove
 
     if args.user:
-        try:
-            csv_file = get_drive_files_for_user(args.user)
-            checked, removed = process_csv(csv_file, args.domain, external_users, dry_run=dry_run)
-            write_run_log(script_name, "success", args.user, args.domain, dry_run, checked, removed)
-        except Exception as e:
-            logging.error(f"Error processing user {args.user}: {e}")
-            write_run_log(script_name, "error", args.user, args.domain, dry_run, 0, 0)
+        _scan_user(args.user, args.domain, external_users, dry_run, batch_threads=args.batch_threads,
+                   count_only=args.count_only)
 
     if args.workspace:
         users_csv = f"{OUTPUT_DIR}/users.csv"
         run_gam_command(["print", "users", "to", "csv", users_csv])
         with open(users_csv, newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                user = row["primaryEmail"]
-                logging.info(f"\n--- Processing {user} ---")
-                try:
-                    user_csv = get_drive_files_for_user(user)
-                    checked, removed = process_csv(user_csv, args.domain, external_users, dry_run=dry_run)
-                    write_run_log(script_name, "success", user, args.domain, dry_run, checked, removed)
-                except Exception as e:
-                    logging.error(f"Error processing user {user}: {e}")
-                    write_run_log(script_name, "error", user, args.domain, dry_run, 0, 0)
-
-        logging.info("\n--- Processing Shared Drives ---")
+            users = [row["primaryEmail"].lower() for row in csv.DictReader(f)]
+
+        log.info("\n--- Processing All Users ---")
+        try:
+            counts = process_csv_by_owner(stream_all_users_acls(args.concurrency), args.domain, external_users, dry_run=dry_run,
+                                          batch_threads=args.batch_threads, count_only=args.count_only)
+            for user in users:
+                checked, queued = counts.pop(user, (0, 0))
+                write_run_log(SCRIPT_NAME, "success", user, args.domain, dry_run, checked, queued)
+            if counts:
+                # Files owned outside the user list (external or unknown owners) share one row
+                checked = sum(c for c, _ in counts.values())
+                queued = sum(q for _, q in counts.values())
+                write_run_log(SCRIPT_NAME, "success", "other_owners", args.domain, dry_run, checked, queued)
+        except Exception as e:
+            # One suspended or Drive-disabled user fails the whole export; rescan per user to isolate it
+            log.error("Error processing all users: %s; falling back to per-user scans", e)
+            # Files visible to several users appear in each of their exports; remove each share only once
+            scan = partial(_scan_user, domain=args.domain, external_users=external_users, dry_run=dry_run,
+                           batch_threads=args.batch_threads, count_only=args.count_only, seen={})
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                list(executor.map(scan, users))
+
+        log.info("\n--- Processing Shared Drives ---")
         try:
-            shared_csv = get_shared_drive_files()
-            checked, removed = process_csv(shared_csv, args.domain, external_users, dry_run=dry_run)
-            write_run_log(script_name, "success", "shared_drives", args.domain, dry_run, checked, removed)
+            checked, queued = process_csv(stream_shared_drive_acls(), args.domain, external_users, dry_run=dry_run,
+                                          batch_threads=args.batch_threads, count_only=args.count_only)
+            write_run_log(SCRIPT_NAME, "success", "shared_drives", args.domain, dry_run, checked, queued)
         except Exception as e:
-            logging.error(f"Error processing shared drives: {e}")
-            write_run_log(script_name, "error", "shared_drives", args.domain, dry_run, 0, 0)
+            log.error("Error processing shared drives: %s", e)
+            write_run_log(SCRIPT_NAME, "error", "shared_drives", args.domain, dry_run, 0, 0)
 
-    logging.info("==== Drive Sharing Scan Completed ====")
+    log.info("==== Drive Sharing Scan Completed ====")
 
-def write_run_log(script_name, status, user, domain, dry_run, checked, removed):
+def write_run_log(script_name, status, user, domain, dry_run, checked, queued):
     log_entry = {
         "script": script_name,
         "run_at": datetime.now(timezone.utc).isoformat(),
@@ -170,11 +481,25 @@ def write_run_log(script_name, status, user, domain, dry_run, checked, removed):
         "domain": domain,
         "dry_run": dry_run,
         "external_users_checked": checked,
-        "external_users_removed": removed
+        # Removals submitted in a GAM batch that exited 0; GAM does not confirm each one
+        "external_users_removed": queued
     }
+    if orjson is not None:
+        line = orjson.dumps(log_entry) + b"\n"
+    else:
+        line = json.dumps(log_entry, separators=(",", ":")).encode("utf-8") + b"\n"
+    with _runlog_lock:
+        open_run_log()
+        _runlog.write(line)
+
+def open_run_log():
+    """Open the run log once for the whole run; buffered entries are flushed at exit"""
+    global _runlog
+    if _runlog is not None:
+        return
     Path(OUTPUT_DIR).mkdir(exist_ok=True)
-    with open(f"{OUTPUT_DIR}/runlog.jsonl", "a", encoding="utf-8") as log_file:
-        log_file.write(json.dumps(log_entry) + "\n")
+    _runlog = open(RUNLOG_FILE, "ab", buffering=RUNLOG_BUFFER)
+    atexit.register(_runlog.close)
 
 
 if __name__ == "__main__":
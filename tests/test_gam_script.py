@@ -0,0 +1,240 @@
+import io
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import unittest
+from contextlib import contextmanager
+from unittest import mock
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import gam_script
+
+ACL_CSV = (
+    'id,title,owners.0.emailAddress,permissions.0.emailAddress,permissions.1.emailAddress,permissions.1.role\n'
+    'f1,Plain,Alice@Example.com,alice@example.com,bob@gmail.com,reader\n'
+    'f2,"Multi\nline, title",carol@example.com,carol@example.com,Dave@Other.org,writer\n'
+    'f3,Internal,alice@example.com,alice@example.com,Eve@EXAMPLE.COM,reader\n'
+    'f4,Link only,alice@example.com,alice@example.com,,reader\n'
+).encode("utf-8")
+
+
+def _stream():
+    return io.BytesIO(ACL_CSV)
+
+
+@contextmanager
+def _failed_export(data=ACL_CSV):
+    """Yield the CSV like stream_gam_csv, then fail as it does when GAM exits non-zero"""
+    yield io.BytesIO(data)
+    raise RuntimeError("Command failed: export interrupted")
+
+
+class OutputDirTestCase(unittest.TestCase):
+    """Run each test in a scratch directory so output/ and the run log stay isolated"""
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+        os.mkdir(gam_script.OUTPUT_DIR)
+
+    def tearDown(self):
+        if gam_script._runlog is not None:
+            gam_script._runlog.close()
+            gam_script._runlog = None
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+
+class ExternalSharesTest(unittest.TestCase):
+    def test_csv_parser_finds_external_shares(self):
+        shares = sorted(gam_script._iter_external_shares_csv(_stream(), "Example.com"))
+        self.assertEqual(shares, [
+            ("alice@example.com", "f1", "Plain", "bob@gmail.com"),
+            ("alice@example.com", "f4", "Link only", ""),
+            ("carol@example.com", "f2", "Multi\nline, title", "dave@other.org"),
+        ])
+
+    def test_unique_shares_skip_files_listed_for_several_users(self):
+        stream = io.BytesIO(ACL_CSV + b'f1,Plain,alice@example.com,bob@example.com,bob@gmail.com,reader\n')
+        counts = gam_script.count_external_shares(stream, "example.com")
+        self.assertEqual(counts, {"alice@example.com": 2, "carol@example.com": 1})
+
+    @unittest.skipIf(gam_script.pa is None, "pyarrow is not installed")
+    def test_arrow_parser_matches_csv_parser(self):
+        expected = sorted(gam_script._iter_external_shares_csv(_stream(), "example.com"))
+        self.assertEqual(sorted(gam_script._iter_external_shares_arrow(_stream(), "example.com")), expected)
+
+    @unittest.skipIf(gam_script.pa is None, "pyarrow is not installed")
+    def test_arrow_count_matches_csv_count(self):
+        data = ACL_CSV + b'f1,Plain,alice@example.com,bob@example.com,bob@gmail.com,reader\n'
+        with mock.patch.object(gam_script, "pa", None):
+            expected = gam_script.count_external_shares(io.BytesIO(data), "example.com")
+        self.assertEqual(gam_script.count_external_shares(io.BytesIO(data), "example.com"), expected)
+
+    @unittest.skipIf(gam_script.pa is None, "pyarrow is not installed")
+    def test_arrow_parser_drains_csv_without_permission_columns(self):
+        stream = io.BytesIO(b"id,title\n" + b"f1,Plain\n" * 1000)
+        self.assertEqual(list(gam_script._iter_external_shares_arrow(stream, "example.com")), [])
+        self.assertEqual(stream.read(), b"")
+
+
+class RunGamBatchTest(OutputDirTestCase):
+    def _run(self, returncode=0, stdout="", stderr=""):
+        written = []
+
+        def fake_run(argv, **kwargs):
+            with open(argv[-1], encoding="utf-8") as f:
+                written.append(f.read())
+            return subprocess.CompletedProcess(argv, returncode, stdout, stderr)
+
+        with mock.patch.object(gam_script.subprocess, "run", side_effect=fake_run) as run:
+            commands = ["gam user admin delete drivefileacl f1 " + shlex.quote("o'neil@gmail.com") + "\n"]
+            result = gam_script.run_gam_batch(commands, batch_threads=4)
+        return run, written, result
+
+    def test_batch_file_lines_survive_shell_splitting(self):
+        run, written, _ = self._run()
+        self.assertEqual(run.call_args[0][0][:5], ["gam", "config", "num_threads", "4", "batch"])
+        self.assertEqual(shlex.split(written[0])[-1], "o'neil@gmail.com")
+
+    def test_batch_file_is_removed_after_success_and_failure(self):
+        self._run()
+        with self.assertRaises(RuntimeError):
+            self._run(returncode=1, stderr="boom")
+        self.assertEqual(os.listdir(gam_script.OUTPUT_DIR), [])
+
+    def test_batch_stderr_is_logged_as_warning(self):
+        with self.assertLogs(gam_script.log, "INFO") as logs:
+            self._run(stdout="Deleted f1\n", stderr="Permission not found: f2\n")
+        self.assertIn(f"WARNING:{gam_script.log.name}:GAM batch: Permission not found: f2", logs.output)
+
+
+class ProcessCsvTest(OutputDirTestCase):
+    external_users = frozenset({"bob@gmail.com", "dave@other.org"})
+
+    def _process(self, source, **kwargs):
+        kwargs.setdefault("dry_run", False)
+        return gam_script.process_csv_by_owner(source, "example.com", self.external_users, **kwargs)
+
+    def test_queued_removals_are_counted_per_owner(self):
+        for pa in (gam_script.pa, None):
+            with self.subTest(pyarrow=pa is not None), mock.patch.object(gam_script, "pa", pa), \
+                    mock.patch.object(gam_script, "run_gam_batch") as batch:
+                counts = self._process(_stream())
+            self.assertEqual(counts, {"alice@example.com": [2, 1], "carol@example.com": [1, 1]})
+            self.assertEqual(len(batch.call_args[0][0]), 2)
+
+    def test_batch_lines_quote_addresses(self):
+        data = b"id,title,permissions.0.emailAddress\nf1,Plain,o'neil@gmail.com\n"
+        with mock.patch.object(self, "external_users", frozenset({"o'neil@gmail.com"})), \
+                mock.patch.object(gam_script, "run_gam_batch") as batch:
+            self._process(io.BytesIO(data))
+        self.assertEqual(shlex.split(batch.call_args[0][0][0])[-2:], ["f1", "o'neil@gmail.com"])
+
+    def test_failed_batch_queues_nothing(self):
+        with mock.patch.object(gam_script, "run_gam_batch", side_effect=RuntimeError("Command failed")):
+            counts = self._process(_stream())
+        self.assertEqual(counts, {"alice@example.com": [2, 0], "carol@example.com": [1, 0]})
+
+    def test_dry_run_submits_nothing(self):
+        with mock.patch.object(gam_script, "run_gam_batch") as batch:
+            self._process(_stream(), dry_run=True)
+        batch.assert_not_called()
+
+    def test_failed_export_submits_no_removals(self):
+        with mock.patch.object(gam_script, "run_gam_batch") as batch, self.assertRaises(RuntimeError):
+            self._process(_failed_export())
+        batch.assert_not_called()
+
+    def test_shared_seen_skips_shares_claimed_by_another_scan(self):
+        seen = {}
+        with mock.patch.object(gam_script, "run_gam_batch") as batch:
+            first = self._process(_stream(), seen=seen)
+            second = self._process(_stream(), seen=seen)
+        self.assertEqual(batch.call_count, 1)
+        self.assertEqual(sum(c for c, _ in first.values()), 3)
+        self.assertEqual(second, {})
+
+
+class StreamGamCsvTest(unittest.TestCase):
+    def _popen(self, script):
+        real_popen = subprocess.Popen
+        return mock.patch.object(gam_script.subprocess, "Popen",
+                                 side_effect=lambda argv, **kw: real_popen([sys.executable, "-c", script], **kw))
+
+    def test_stream_yields_gam_stdout(self):
+        with self._popen("print('id,title')"), gam_script.stream_gam_csv(["print", "users"]) as stream:
+            self.assertEqual(stream.read().strip(), b"id,title")
+
+    def test_unauthenticated_gam_is_reported(self):
+        script = "import sys; print('id'); sys.stderr.write('No Client Access allowed'); sys.exit(1)"
+        with self._popen(script), self.assertRaisesRegex(RuntimeError, "appears to be unauthenticated"):
+            with gam_script.stream_gam_csv(["print", "users"]) as stream:
+                stream.read()
+
+    def test_missing_gam_is_reported(self):
+        with mock.patch.object(gam_script.subprocess, "Popen", side_effect=FileNotFoundError), \
+                self.assertRaisesRegex(RuntimeError, "'gam' command not found"):
+            with gam_script.stream_gam_csv(["print", "users"]):
+                pass
+
+    def test_multiprocess_arguments(self):
+        with self._popen("pass") as popen, gam_script.stream_gam_csv(["all", "users"], num_threads=8) as stream:
+            stream.read()
+        self.assertEqual(popen.call_args[0][0],
+                         ["gam", "config", "num_threads", "8", "redirect", "csv", "-", "multiprocess", "all", "users"])
+
+
+class WorkspaceScanTest(OutputDirTestCase):
+    def _main(self, all_users_export):
+        def fake_gam(args):
+            if args[:2] == ["print", "users"]:
+                with open(args[-1], "w", encoding="utf-8") as f:
+                    f.write("primaryEmail\nalice@example.com\nbob@example.com\n")
+            return ""
+
+        with open("external_users.txt", "w") as f:
+            f.write("bob@gmail.com\n")
+        argv = ["gam_script.py", "--workspace", "--domain", "example.com", "--remove"]
+        with mock.patch.object(sys, "argv", argv), \
+                mock.patch.object(gam_script, "setup_logging"), \
+                mock.patch.object(gam_script, "run_gam_command", side_effect=fake_gam), \
+                mock.patch.object(gam_script, "run_gam_batch") as batch, \
+                mock.patch.object(gam_script, "stream_all_users_acls", return_value=all_users_export), \
+                mock.patch.object(gam_script, "stream_user_acls", side_effect=lambda user: _stream()), \
+                mock.patch.object(gam_script, "stream_shared_drive_acls", side_effect=lambda: io.BytesIO(b"id\n")):
+            gam_script.main()
+        gam_script._runlog.flush()
+        with open(gam_script.RUNLOG_FILE, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f]
+        return batch, {row["user"]: (row["status"], row["external_users_checked"], row["external_users_removed"])
+                       for row in rows}
+
+    def test_owners_outside_the_user_list_share_one_row(self):
+        data = ACL_CSV + b"f9,Foreign,ext@other.com,ext@other.com,bob@gmail.com,reader\n"
+        batch, rows = self._main(io.BytesIO(data))
+        self.assertEqual(rows, {
+            "alice@example.com": ("success", 2, 1),
+            "bob@example.com": ("success", 0, 0),
+            "other_owners": ("success", 3, 1),
+            "shared_drives": ("success", 0, 0),
+        })
+        batch.assert_called_once()
+
+    def test_failed_bulk_export_falls_back_to_deduplicated_user_scans(self):
+        batch, rows = self._main(_failed_export())
+        self.assertEqual(batch.call_count, 1)
+        self.assertEqual(len(batch.call_args[0][0]), 1)
+        users = [rows["alice@example.com"], rows["bob@example.com"]]
+        self.assertEqual([status for status, _, _ in users], ["success", "success"])
+        self.assertEqual(sum(checked for _, checked, _ in users), 3)
+        self.assertEqual(sum(removed for _, _, removed in users), 1)
+
+if __name__ == "__main__":
+    unittest.main()